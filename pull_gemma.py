@@ -1,17 +1,42 @@
+import sys
+import time
 import ollama
+from utils.ollama_config import ollama_base_url, has_model
+
+client = ollama.Client(host=ollama_base_url())   # same server the other scripts use
+
+if has_model('gemma3:4b'):
+    print("gemma3:4b already installed")
+    sys.exit(0)
+
 print("This may take 2-3 minutes...")
 print("-" * 60)
 
+MIN_BYTES_FOR_UPDATE = 5 * 1024 * 1024  # redraw at most every 5MB or 0.2s
+
 try:
-    stream = ollama.pull('gemma3:4b', stream=True)
+    stream = client.pull('gemma3:4b', stream=True)
+    write = sys.stdout.write
+    last_print = 0.0
+    last_bytes = 0
+    last_status = None
     for chunk in stream:
         status = chunk.get('status', '')
-        if status:
-            print(f"\r{status}", end='', flush=True)
+        if not status:
+            continue
+        completed = chunk.get('completed') or 0
+        total = chunk.get('total')
+        now = time.monotonic()
+        if (status != last_status or status == 'success' or now - last_print > 0.2
+                or completed - last_bytes >= MIN_BYTES_FOR_UPDATE):
+            progress = f" {completed * 100 // total}%" if total else ""
+            write(f"\r{status}{progress}")
+            sys.stdout.flush()
+            last_print, last_bytes, last_status = now, completed, status
     
     print("\ngemma3:4b downloaded successfully!")
     print("\nAvailable models:")
-    models = ollama.list()
+    models = client.list()
     for model in models['models']: 
         print(f"{model['name']}")
     
@@ -1,75 +1,138 @@
-import ollama
+import os
 import time
+import orjson
+import asyncio
+import aiohttp
+from tqdm import tqdm
 
-def pull_model(model_name):
-    print(f"\n{'='*60}")
-    print(f"Downloading: {model_name}")
-    print(f"{'='*60}")
-    
-    try:
-        stream = ollama.pull(model_name, stream=True)
-        for chunk in stream:
-            status = chunk.get('status', '')
-            if status:
-                print(f"\r{status}", end='', flush=True)
-        
-        print(f"\n{model_name} downloaded successfully!")
-        return True
-        
-    except Exception as e:
-        print(f"\nError downloading {model_name}: {e}")
-        return False
+from utils.ollama_config import ollama_base_url
+
+OLLAMA_URL = ollama_base_url()
+PULL_CONCURRENCY = int(os.getenv("OLLAMA_PULL_CONCURRENCY", 2))  # models downloading at the same time
+MIN_BYTES_FOR_UPDATE = 5 * 1024 * 1024  # redraw at most every 5MB or 0.2s
+
+# Streams one model from ollama's /api/pull, the progress bar is shared by position so parallel pulls dont overwrite each other
+async def pull_model_async(session, model_name, semaphore=None, position=0):
+    semaphore = semaphore or asyncio.Semaphore(1)
+    async with semaphore:
+        bar = tqdm(desc=model_name, unit="B", unit_scale=True, position=position, leave=True)
+        last_print = 0.0
+        last_bytes = 0
+        last_status = None
+        try:
+            async with session.post(f"{OLLAMA_URL}/api/pull", json={"name": model_name, "stream": True}) as resp:
+                resp.raise_for_status()
+                async for line in resp.content:
+                    if not line.strip():
+                        continue
+                    chunk = orjson.loads(line)
+                    if "error" in chunk:
+                        raise RuntimeError(chunk["error"])
+                    status = chunk.get('status', '')
+                    completed = chunk.get('completed') or 0
+                    if chunk.get('total'):
+                        bar.total = chunk['total']
+                        bar.n = completed
+                    now = time.monotonic()
+                    if (status != last_status or status == 'success' or now - last_print > 0.2
+                            or completed - last_bytes >= MIN_BYTES_FOR_UPDATE):
+                        if status:
+                            bar.set_postfix_str(status, refresh=False)
+                        bar.refresh()
+                        last_print, last_bytes, last_status = now, completed, status
 
-def list_models():
+            bar.close()
+            print(f"\n{model_name} downloaded successfully!")
+            return True
+
+        except Exception as e:
+            bar.close()
+            print(f"\nError downloading {model_name}: {e}")
+            return False
+
+# Raw /api/tags listing, no printing so callers can reuse the result
+async def _fetch_models(session):
     try:
-        result = ollama.list()
-        print("\n" + "="*60)
-        print("Available Models:")
-        print("="*60)
-        
-        if not result.get('models'):
-            print("No models installed yet")
-            return []
-        
-        models = []
-        for model in result['models']:
-            name = model['name']
-            size_gb = model['size'] / (1024**3)
-            models.append(name)
-            print(f"{name:30} ({size_gb:.2f} GB)")
-        
-        return models
-        
+        async with session.get(f"{OLLAMA_URL}/api/tags") as resp:
+            resp.raise_for_status()
+            result = await resp.json(loads=orjson.loads)
+        return result.get('models') or []
+
     except Exception as e:
         print(f"Error listing models: {e}")
         return []
 
-def main():
+def _print_models(models):
+    print("\n" + "="*60)
+    print("Available Models:")
+    print("="*60)
+
+    if not models:
+        print("No models installed yet")
+        return
+
+    for model in models:
+        size_gb = model['size'] / (1024**3)
+        print(f"{model['name']:30} ({size_gb:.2f} GB)")
+
+# ollama reports untagged pulls as "name:latest", both spellings count as installed
+def _installed_names(models):
+    names = set()
+    for model in models:
+        names.add(model['name'])
+        if model['name'].endswith(':latest'):
+            names.add(model['name'][:-len(':latest')])
+    return names
+
+async def list_models(session):
+    models = await _fetch_models(session)
+    _print_models(models)
+    return [model['name'] for model in models]
+
+async def main_async():
     print("="*60)
     print("OLLAMA MODEL DOWNLOADER")
     print("="*60)
 
-    print("\nChecking existing models")
-    existing_models = list_models()
-    
     required_models = ['nomic-embed-text', 'llama3']
-    
-    for model in required_models:
-        if model in existing_models:
-            print(f"\n✓ {model} already installed, skipping")
-        else:
-            success = pull_model(model)
-            if not success:
+
+    # pull requests are long lived streams, so no total timeout
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=8), timeout=timeout) as session:
+        print("\nChecking existing models")
+        before = await _fetch_models(session)
+        _print_models(before)
+        existing_models = _installed_names(before)
+
+        missing = []
+        for model in required_models:
+            if model in existing_models:
+                print(f"\n✓ {model} already installed, skipping")
+            else:
+                missing.append(model)
+
+        semaphore = asyncio.Semaphore(PULL_CONCURRENCY)
+        results = await asyncio.gather(*[
+            pull_model_async(session, model, semaphore, position=i)
+            for i, model in enumerate(missing)
+        ])
+        downloaded = []
+        for model, success in zip(missing, results):
+            if success:
+                downloaded.append(model)
+            else:
                 print(f"\n⚠ Failed to download {model}")
-                # Ask if user wants to continue
-                continue
-    
-    print("\n" + "="*60)
-    print("FINAL STATUS")
-    print("="*60)
-    list_models()
-    
+
+        print("\n" + "="*60)
+        print("FINAL STATUS")
+        print("="*60)
+        # nothing new was pulled, the first listing is still accurate
+        _print_models(await _fetch_models(session) if downloaded else before)
+
     print("\nSetup complete")
 
+def main():
+    asyncio.run(main_async())
+
 if __name__ == "__main__":
     main()
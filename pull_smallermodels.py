@@ -1,25 +1,30 @@
-import ollama
+import asyncio
+import aiohttp
+from pull_llama import pull_model_async, list_models
+from utils.ollama_config import has_model
+
 models_to_try = [
-    'neural-chat:latest', 
-    'dolphin-mixtral:latest', 
+    'neural-chat:latest',
+    'dolphin-mixtral:latest',
 ]
 
-for model in models_to_try:
-    print(f"\nTrying to pull {model}...")
-    try:
-        stream = ollama.pull(model, stream=True)
-        for chunk in stream:
-            status = chunk.get('status', '')
-            if status:
-                print(f"\r{status}", end='', flush=True)
-        print(f"\n✓ {model} downloaded successfully!")
-        break
-    except Exception as e:
-        print(f"\n✗ {model} failed: {str(e)[:100]}")
-        continue
+# Fallback list, stops at the first model that pulls fine so these are not gathered in parallel
+async def main():
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=8), timeout=timeout) as session:
+        installed = [model for model in models_to_try if has_model(model)]
+        if installed:
+            print(f"{installed[0]} already installed")
+            return
+
+        for model in models_to_try:
+            print(f"\nTrying to pull {model}...")
+            if await pull_model_async(session, model):
+                break
+            print(f"\n✗ {model} failed")
+
+        print("\n" + "="*60)
+        await list_models(session)
 
-print("\n" + "="*60)
-print("Available models:")
-models = ollama.list()
-for model in models['models']:
-    print(f" {model['name']}")
+if __name__ == "__main__":
+    asyncio.run(main())
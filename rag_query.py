@@ -1,163 +1,341 @@
 import os
 import sys
 import argparse
+import atexit
+import functools
+import unicodedata
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient
-import ollama
+import orjson
 import time
-from typing import List, Dict, Any, Optional
-from utils.cache_manager import PromptCache, ConversationalMemory
+import asyncio
+from typing import List, Dict, Any, Optional, Callable, TYPE_CHECKING
+from utils.cache_manager import PromptCache, ConversationalMemory, content_hash
+from utils.ollama_config import ollama_base_url
+
+# qdrant/groq/httpx/requests are imported where they are first needed, so --clear-cache/--clear-memory start fast
+if TYPE_CHECKING:
+    from groq import Groq, AsyncGroq
+    from qdrant_client import AsyncQdrantClient
 
 load_dotenv()
 
 # Configs
 QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", 6334))
 COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME", "trigonometry_chapter")
 EMBEDDING_MODEL = os.getenv("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text")
+OLLAMA_URL = ollama_base_url()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92))
+MEMORY_BUDGET = int(os.getenv("MEMORY_BUDGET", 2000))   # approx tokens of chat history kept before compaction
+
+RETRIEVED_PAYLOAD_FIELDS = ['page', 'source', 'image_filename', 'text']
+
+# Prompt templates live here so they can be tweaked/A-B tested in one place, only the context and question vary per call
+# Prompt is taken from www.promptgenie.com
+_ANSWER_TMPL = """You are an expert academic tutor specializing in mathematics, especially trigonometry and geometry. 
+Answer the question based ONLY on the provided context. Be clear, concise, and educational.
+
+Context:
+{context_str}
+{history_str}
+Question: {question}
+
+Answer:"""
+
+# Summarization prompt created from prompt genie
+_SUMMARY_TMPL = """You are analyzing content from a mathematics textbook chapter on trigonometry applications.
+
+Retrieved Context:
+{combined_text}
+
+Provide a concise summary (2-3 sentences) highlighting the key mathematical concepts, formulas, or examples mentioned in the retrieved content:"""
 
 # Init cache and memory
 prompt_cache = PromptCache()
 conversation_memory = ConversationalMemory()
 
+# Clients are created once and reused so repeated queries keep their keep-alive connections.
+# The async ones hold connections bound to an event loop, so run_query keeps one loop for the whole process (_query_loop).
+# They are only rebuilt if a caller drives run_query_async from a different loop of its own
+_groq: Optional["Groq"] = None
+_async_groq: Optional["AsyncGroq"] = None
+_async_qdrant: Optional["AsyncQdrantClient"] = None
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+_query_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _get_groq() -> "Groq":
+    global _groq
+    if _groq is None:
+        if not GROQ_API_KEY:
+            raise ValueError("GROQ_API_KEY not in .env file!")
+        import httpx
+        from groq import Groq
+        http_client = httpx.Client(http2=True, timeout=httpx.Timeout(30, connect=5))
+        _groq = Groq(api_key=GROQ_API_KEY, http_client=http_client)
+    return _groq
+
+def _bind_async_clients():
+    global _async_groq, _async_qdrant, _async_loop
+    loop = asyncio.get_running_loop()
+    if _async_loop is not loop:
+        _async_groq = None
+        _async_qdrant = None
+        _async_loop = loop
+
+async def _aclose_async_clients():
+    global _async_groq, _async_qdrant
+    for client in (_async_groq, _async_qdrant):
+        if client is not None:
+            try:
+                await client.close()   # AsyncGroq closes its httpx client, AsyncQdrantClient its gRPC channel
+            except Exception as e:
+                print(f"Error closing client: {e}")
+    _async_groq = None
+    _async_qdrant = None
+
+# Registered the first time run_query creates the loop, closes the clients on the loop they belong to
+def _close_query_loop():
+    global _query_loop
+    if _query_loop is None:
+        return
+    _query_loop.run_until_complete(_aclose_async_clients())
+    _query_loop.run_until_complete(_query_loop.shutdown_asyncgens())
+    _query_loop.close()
+    _query_loop = None
+
+def _get_async_groq() -> "AsyncGroq":
+    global _async_groq
+    _bind_async_clients()
+    if _async_groq is None:
+        if not GROQ_API_KEY:
+            raise ValueError("GROQ_API_KEY not in .env file!")
+        import httpx
+        from groq import AsyncGroq
+        http_client = httpx.AsyncClient(http2=True, timeout=httpx.Timeout(30, connect=5))
+        _async_groq = AsyncGroq(api_key=GROQ_API_KEY, http_client=http_client)
+    return _async_groq
+
+def _get_async_qdrant() -> "AsyncQdrantClient":
+    global _async_qdrant
+    _bind_async_clients()
+    if _async_qdrant is None:
+        from qdrant_client import AsyncQdrantClient
+        _async_qdrant = AsyncQdrantClient(host=QDRANT_HOST, port=QDRANT_PORT, grpc_port=QDRANT_GRPC_PORT, prefer_grpc=True)
+    return _async_qdrant
+
+# Uses ollama's batch /api/embed endpoint, all texts go in one request and one model eval
+def generate_embeddings_batch(texts: List[str], model: str = EMBEDDING_MODEL) -> List[list]:
+    import requests
+    response = requests.post(f"{OLLAMA_URL}/api/embed", json={"model": model, "input": texts}, timeout=60)
+    response.raise_for_status()
+    return orjson.loads(response.content)["embeddings"]
+
+# Same question in one process (retries, semantic lookup then retrieval) only goes to ollama once
+@functools.lru_cache(maxsize=512)
+def _embed_cached(model: str, text: str) -> tuple:
+    return tuple(generate_embeddings_batch([text], model)[0])
+
 # Uses ollama to generate the embeddings
 def generate_embeddings(text: str, model: str = EMBEDDING_MODEL) -> list:
-    response = ollama.embeddings(model=model, prompt=text)
-    return response["embedding"]
+    return list(_embed_cached(model, text))
+
+
+# Fixed length cache key, question is normalized so casing/whitespace variants of the same question share an entry
+def _cache_key(question: str, summarize: bool, conversational: bool) -> str:
+    normalized = unicodedata.normalize('NFC', question).strip().lower()
+    flags = (b'1' if summarize else b'0') + (b'1' if conversational else b'0')
+    return content_hash(b'v1|' + normalized.encode('utf-8') + b'|' + flags)
 
 
 # Takes user query , qdrant client  and results to retrieve for a quick dmeo I have done it to 5 , Gives you a list of relevent docs 
-def retrieve_context(query: str, client: QdrantClient, top_k: int = 5) -> list:
-    # Generating query embeddings
-    query_embedding = generate_embeddings(query)
+async def _aretrieve(query: str, client: "AsyncQdrantClient", top_k: int = 5,
+                     query_embedding: Optional[list] = None) -> list:
+    from qdrant_client import models
+    
+    # Generating query embeddings (skipped when run_query already has it from the cache lookup)
+    if query_embedding is None:
+        query_embedding = await asyncio.to_thread(generate_embeddings, query)
     
-    # Searching in qdrant
-    results = client.search(
+    # Searching in qdrant, only the payload fields we print are sent back and never the vectors
+    results = await client.search(
         collection_name=COLLECTION_NAME,
         query_vector=query_embedding,
-        limit=top_k
+        limit=top_k,
+        with_payload=RETRIEVED_PAYLOAD_FIELDS,
+        with_vectors=False,
+        score_threshold=0.0,
+        search_params=models.SearchParams(
+            hnsw_ef=64,
+            exact=False,
+            quantization=models.QuantizationSearchParams(ignore=False, rescore=True, oversampling=2.0),
+        ),
     )
     
     return results
 
-# Summarization is not done using ollama but used groq we pass the list we got from retrieve_context , groq summarizes
-def summarize_context(contexts: list) -> str:
-    from groq import Groq
-    if not GROQ_API_KEY:
-        raise ValueError("GROQ_API_KEY not in .env file!")
-    
-    client = Groq(api_key=GROQ_API_KEY)
-    
-    # Combining contexts
-    combined_text = "\n\n".join([
-        f"Source {i+1} (Page {ctx.payload['page']+1}): {ctx.payload['text'][:300]}..." 
-        for i, ctx in enumerate(contexts)
-    ])
-    
-    # Summarization prompt created from prompt genie
-    prompt = f"""You are analyzing content from a mathematics textbook chapter on trigonometry applications.
+def _echo_token(token: str):
+    sys.stdout.write(token)
+    sys.stdout.flush()
 
-Retrieved Context:
-{combined_text}
+# Reads a streamed Groq completion, every delta is handed to on_token as it arrives and the full text is returned
+async def _astream_completion(response, on_token: Optional[Callable[[str], None]] = None) -> str:
+    chunks = []
+    async for event in response:
+        delta = event.choices[0].delta.content
+        if delta:
+            if on_token:
+                on_token(delta)
+            chunks.append(delta)
+    return "".join(chunks)
 
-Provide a concise summary (2-3 sentences) highlighting the key mathematical concepts, formulas, or examples mentioned in the retrieved content:"""
+# One pass over the retrieved points builds both the answer prompt context and the shorter summary context
+def _prepare_contexts(contexts: list) -> tuple:
+    answer_parts = []
+    summary_parts = []
+    for i, ctx in enumerate(contexts):
+        payload = ctx.payload
+        text = payload['text']
+        answer_parts.append(f"[Source {i+1}]\n{text}")
+        summary_parts.append(f"Source {i+1} (Page {payload['page']+1}): {text[:300]}...")
+    return "\n\n".join(answer_parts), "\n\n".join(summary_parts)
+
+# Summarization is not done using ollama but used groq we pass the combined string from _prepare_contexts , groq summarizes
+async def _asummarize_context(combined_text: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+    client = _get_async_groq()
+    
+    prompt = _SUMMARY_TMPL.format(combined_text=combined_text)
     
     # GROQ generating summaries 
-    message = client.chat.completions.create(
+    message = await client.chat.completions.create(
         messages=[{"role": "user", "content": prompt}],
         model="llama-3.3-70b-versatile",
         max_tokens=300,
         temperature=0.7,
+        stream=True,
     )
-    return message.choices[0].message.content
+    return await _astream_completion(message, on_token)
 
 
-# This is the final answer generated , we take question , list of 5 top k relevent strings , returns the para
-def generate_answer(question: str, contexts: List[str], use_memory: bool = False) -> str:
-    from groq import Groq
+# This is the final answer generated , we take question , the joined top k context string , returns the para
+async def _agenerate_answer(question: str, context_str: str, use_memory: bool = False,
+                            on_token: Optional[Callable[[str], None]] = None) -> str:
+    client = _get_async_groq()
     
-    # Validate API key
-    if not GROQ_API_KEY:
-        raise ValueError("GROQ_API_KEY not in .env file!")
-
-    client = Groq(api_key=GROQ_API_KEY)
- 
-    context_str = "\n\n".join([f"[Source {i+1}]\n{ctx}" for i, ctx in enumerate(contexts)])
-    
-    # Prompt is taken from www.promptgenie.com
-    prompt = f"""You are an expert academic tutor specializing in mathematics, especially trigonometry and geometry. 
-Answer the question based ONLY on the provided context. Be clear, concise, and educational.
-
-Context:
-{context_str}
-
-Question: {question}
-
-Answer:"""
+    # earlier turns (and the compacted summary of older ones) go between the context and the question
+    history_str = ""
+    if use_memory and conversation_memory.messages:
+        history_str = f"\nConversation so far:\n{conversation_memory.get_formatted_history()}\n"
+    prompt = _ANSWER_TMPL.format(context_str=context_str, history_str=history_str, question=question)
     
     # Using groq not ollama
-    print("Generating answer using Groq (llama-3.1-70b)...")
-    message = client.chat.completions.create(
+    message = await client.chat.completions.create(
         messages=[{"role": "user", "content": prompt}],
         model="llama-3.3-70b-versatile",
         max_tokens=500,
         temperature=0.7,
+        stream=True,
     )
     
+    return await _astream_completion(message, on_token)
+
+# Cheap Groq call used by conversation_memory.compact to fold old turns into a short recap
+def _groq_summarize(messages: List[Dict[str, str]]) -> str:
+    client = _get_groq()
+    history = "\n".join(f"{'User' if m['role'] == 'user' else 'AI'}: {m['content']}" for m in messages)
+    message = client.chat.completions.create(
+        messages=[{"role": "user", "content": f"Summarize this tutoring conversation in 3-4 sentences, keeping any formulas or numbers that were discussed:\n\n{history}"}],
+        model="llama-3.1-8b-instant",
+        max_tokens=200,
+        temperature=0.3,
+    )
     return message.choices[0].message.content
 
-# formatting of source citations as req in assignment
+_NL_TABLE = str.maketrans({'\n': ' ', '\r': ' ', '\t': ' '})
+
+# formatting of source citations as req in assignment, overlapping chunks that give the same preview are listed once
 def format_sources(contexts: list) -> str:
 
     sources = []
+    append = sources.append
+    seen = set()
     for i, ctx in enumerate(contexts):
-        page = ctx.payload['page'] + 1
-        source_type = ctx.payload.get('source', 'text')
-        text = ctx.payload['text']
+        payload = ctx.payload
+        page = payload['page'] + 1
+        source_type = payload.get('source', 'text')
+        text = payload['text']
+        
+        preview = text[:150].translate(_NL_TABLE)
+        if len(text) > 150:
+            preview += "..."
         
-        preview = text[:150].replace('\n', ' ') + "..." if len(text) > 150 else text.replace('\n', ' ')
+        # only truly identical lines are dropped, diagrams on the same page differ by file
+        dedupe_key = (page, source_type, payload.get('image_filename'), preview)
+        if dedupe_key in seen:
+            continue
+        seen.add(dedupe_key)
         
         if source_type == 'image':
-            image_file = ctx.payload.get('image_filename', 'unknown')
-            sources.append(f"  [{i+1}] Page {page} (DIAGRAM: {image_file})")
-            sources.append(f"      {preview}")
+            image_file = payload.get('image_filename', 'unknown')
+            append(f"  [{i+1}] Page {page} (DIAGRAM: {image_file})")
         else:
-            sources.append(f"  [{i+1}] Page {page} (text)")
-            sources.append(f"      {preview}")
+            append(f"  [{i+1}] Page {page} (text)")
+        append(f"      {preview}")
     
     return "\n".join(sources)
 
+# Bump when the layout below changes so older cached display blocks get re-rendered
+DISPLAY_VERSION = 1
+
+# Answer + sources block shown on a cache hit, rendered once and stored with the cached response
+def _render_display(answer: str, sources: str) -> str:
+    sep = "-" * 70
+    return "\n".join(["", sep, "FINAL ANSWER:", sep, answer, "", sep, "SOURCES:", sep, sources, ""])
+
 # The main part is from this block, You pass a query , with 3 more args
-def run_query(question: str, summarize: bool = False, use_cache: bool = True, 
-              conversational: bool = False):
+async def run_query_async(question: str, summarize: bool = False, use_cache: bool = True, 
+                          conversational: bool = False, memory_budget: int = MEMORY_BUDGET):
     print("\n" + "=" * 70)
     print(f"QUERY: {question}")
     print("=" * 70)
     
     start_time = time.time()
     
+    # with earlier turns in the prompt the answer depends on more than the question,
+    # so it is neither served from nor stored in the cache
+    if conversational and conversation_memory.messages:
+        use_cache = False
+    
     cached_response = None
+    query_embedding = None
+    cache_key = _cache_key(question, summarize, conversational)
+    # paraphrases only match answers made with the same flags, and only vectors from the same embedding model are compared
+    semantic_ns = f"{EMBEDDING_MODEL}:{int(summarize)}{int(conversational)}"
     if use_cache:
-        cache_key = f"{question}_{summarize}_{conversational}"
         cached_response = prompt_cache.get(cache_key, "groq")
+        if not cached_response:
+            try:
+                query_embedding = await asyncio.to_thread(generate_embeddings, question)
+                cached_response = prompt_cache.semantic_get(query_embedding, "groq", threshold=SEMANTIC_CACHE_THRESHOLD,
+                                                            namespace=semantic_ns)
+            except Exception as e:
+                print(f"Semantic cache lookup skipped: {e}")
     
     if cached_response:
         elapsed = time.time() - start_time
         print(f"\n⚡ Retrieved from cache (Time: {elapsed:.2f}s)")
-        print("\n" + "-" * 70)
-        print("FINAL ANSWER:")
-        print("-" * 70)
-        print(cached_response["response"]["answer"])
-        print("\n" + "-" * 70)
-        print("SOURCES:")
-        print("-" * 70)
-        print(cached_response["response"]["sources"])
+        response = cached_response["response"]
+        if response.get("display_version") == DISPLAY_VERSION:
+            display = response["display"]
+        else:
+            display = _render_display(response["answer"], response["sources"])   # entries cached before display blocks
+        sys.stdout.write(display)
         return
     
     # Init the Qdrant client 
     try:
-        client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+        client = _get_async_qdrant()
     except Exception as e:
         print(f"\n Error connecting to Qdrant: {e}")
         print("Make sure Qdrant is running: docker-compose up -d")   # better for debugging , wasted 20 mins here :(
@@ -165,7 +343,7 @@ def run_query(question: str, summarize: bool = False, use_cache: bool = True,
     
     # First is retrieve the context
     print(f"\n[1/3] Retrieving relevant context from Qdrant...")
-    contexts = retrieve_context(question, client, top_k=5)
+    contexts = await _aretrieve(question, client, top_k=5, query_embedding=query_embedding)
     
     if not contexts:
         print("No relevant context found. Make sure setup_pipeline.py has been run.")
@@ -174,48 +352,61 @@ def run_query(question: str, summarize: bool = False, use_cache: bool = True,
     print(f"Retrieved {len(contexts)} relevant chunks")
     
     # Printing some retrieved stuff
-    text_sources = sum(1 for c in contexts if c.payload.get('source') == 'text')
-    image_sources = sum(1 for c in contexts if c.payload.get('source') == 'image')
+    source_types = [c.payload.get('source') for c in contexts]
+    text_sources = source_types.count('text')
+    image_sources = source_types.count('image')
     if image_sources > 0:
         print(f"  - Text chunks: {text_sources}")
         print(f"  - Diagram chunks: {image_sources}")
     
+    # Building the prompt contexts once for both Groq calls
+    context_str, summary_str = _prepare_contexts(contexts)
+    
+    # Summary and answer are independent Groq calls over the same contexts, so both go out together.
+    # The summary streams straight to the terminal while answer tokens wait in a queue until it is done
+    answer_tokens: asyncio.Queue = asyncio.Queue()
+    answer_task = asyncio.create_task(
+        _agenerate_answer(question, context_str, conversational, answer_tokens.put_nowait)
+    )
+    answer_task.add_done_callback(lambda _: answer_tokens.put_nowait(None))
+    
+    # Sources only depend on the retrieved chunks, formatted while the answer is generating
+    sources = format_sources(contexts)
+    
     # Summarization using groq (ollama can't be pulled due to less space)
     if summarize:
         print(f"\n[2/3] Generating summary of retrieved context using Groq...")
+        print("\n" + "-" * 70)
+        print("RETRIEVED CONTEXT SUMMARY:")
+        print("-" * 70)
         try:
-            summary = summarize_context(contexts)
-            print("\n" + "-" * 70)
-            print("RETRIEVED CONTEXT SUMMARY:")
-            print("-" * 70)
-            print(summary)
-            print("-" * 70)
+            await _asummarize_context(summary_str, _echo_token)
         except Exception as e:
-            print(f"Summarization failed: {e}")
+            print(f"Summarization failed: {e}", end="")
+        print("\n" + "-" * 70)
     else:
         print(f"\n[2/3] Skipping summarization...")
     
     # Generating ans now
     print(f"\n[3/3] Generating answer using Groq...")
-    
-    # Adding conversational memory 
-    if conversational:
-        conversation_memory.add_user_message(question)
-    
-    # Extracting text from contexts
-    context_texts = [ctx.payload['text'] for ctx in contexts]
+    print("\n" + "-" * 70)
+    print("FINAL ANSWER:")
+    print("-" * 70)
+    while (token := await answer_tokens.get()) is not None:
+        _echo_token(token)
+    print()
     
     try:
-        answer = generate_answer(question, context_texts, use_memory=conversational)
+        answer = await answer_task
     except Exception as e:
         print(f"\n Error generating answer: {e}")
         return
     
+    # Adding conversational memory, the question only goes in together with its answer
     if conversational:
+        conversation_memory.add_user_message(question)
         conversation_memory.add_ai_message(answer)
     
-    sources = format_sources(contexts)
-    
     elapsed_time = time.time() - start_time
     
     # To Cache responses
@@ -223,24 +414,42 @@ def run_query(question: str, summarize: bool = False, use_cache: bool = True,
         response_data = {
             "answer": answer,
             "sources": sources,
-            "time": elapsed_time
+            "time": elapsed_time,
+            "display": _render_display(answer, sources),
+            "display_version": DISPLAY_VERSION
         }
-        prompt_cache.set(f"{question}_{summarize}_{conversational}", "groq", response_data)
+        prompt_cache.set(cache_key, "groq", response_data)
+        if query_embedding is not None:
+            try:
+                prompt_cache.semantic_set(query_embedding, cache_key, "groq", namespace=semantic_ns)
+            except Exception as e:
+                print(f"Semantic cache update skipped: {e}")
 
     print("\n" + "=" * 70)
     print(f"✓ QUERY COMPLETE (Time: {elapsed_time:.2f}s)")
     print("=" * 70)
     
-    print("\n" + "-" * 70)
-    print("FINAL ANSWER:")
-    print("-" * 70)
-    print(answer)
-    
     print("\n" + "-" * 70)
     print("SOURCES:")
     print("-" * 70)
     print(sources)
     print()
+    
+    # compacted only after everything is shown, the summary call doesn't hold up this answer
+    if conversational:
+        try:
+            await asyncio.to_thread(conversation_memory.compact, max_tokens=memory_budget, summarizer=_groq_summarize)
+        except Exception as e:
+            print(f"Memory compaction failed: {e}")
+
+# Sync entry point so the CLI (and any old callers) stay unchanged. Every call runs on the same loop so the async
+# clients (and their connections) made by the first query are reused by the next ones
+def run_query(*args, **kwargs):
+    global _query_loop
+    if _query_loop is None:
+        _query_loop = asyncio.new_event_loop()
+        atexit.register(_close_query_loop)
+    return _query_loop.run_until_complete(run_query_async(*args, **kwargs))
 
 # this is the main entry point
 def main():
@@ -255,34 +464,43 @@ Examples:
   python rag_query.py --question "Who can use trigonometry?" --conversational
         """
     )
-    parser.add_argument("--question", "-q", type=str, required=True, 
-                       help="Question to ask about the trigonometry chapter")
+    parser.add_argument("--question", "-q", type=str, 
+                       help="Question to ask about the trigonometry chapter (optional with --clear-cache/--clear-memory)")
     parser.add_argument("--summarize", "-s", action="store_true", 
                        help="Show context summarization before final answer")
     parser.add_argument("--no-cache", action="store_true", 
                        help="Disable caching (force new LLM generation)")
     parser.add_argument("--conversational", "-c", action="store_true", 
                        help="Enable conversational memory for follow-up questions")
-    parser.add_argument("--clear-cache", action="store_true", 
-                       help="Clear cache before running query")
+    parser.add_argument("--clear-cache", nargs="?", const="all", metavar="MODEL", 
+                       help="Clear cache before running query (pass a model name, e.g. groq, to only drop that model's answers)")
     parser.add_argument("--clear-memory", action="store_true", 
                        help="Clear conversation memory")
+    parser.add_argument("--memory-budget", type=int, default=MEMORY_BUDGET,
+                       help="Approx token budget for conversation memory before old turns are summarized")
     
     args = parser.parse_args()
     
-    if args.clear_cache:
+    if args.clear_cache == "all":
         prompt_cache.clear()
-        print("Cache cleared")
+    elif args.clear_cache:
+        prompt_cache.invalidate_by_model(args.clear_cache)
     
     if args.clear_memory:
         conversation_memory.clear()
-        print("Conversation memory cleared")
+    
+    # Only housekeeping was asked for, nothing to query
+    if not args.question:
+        if args.clear_cache or args.clear_memory:
+            return
+        parser.error("--question is required")
     
     run_query(
         question=args.question,
         summarize=args.summarize,
         use_cache=not args.no_cache,   # double negative for caching
-        conversational=args.conversational
+        conversational=args.conversational,
+        memory_budget=args.memory_budget
     )
 
 
@@ -1,33 +1,123 @@
 import os
 import sys
+import logging
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
-import ollama
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType, OptimizersConfigDiff,
+)
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import asyncio
+import itertools
+import queue
+import threading
+import aiohttp
+from collections import Counter
+from typing import List, Dict, Iterable, Iterator, Optional
 from tqdm import tqdm
 
 from utils.pdf_parser import MultimodalPDFParser
 from utils.chunking import AcademicChunker
+from utils.cache_manager import PromptCache
+from utils.ollama_config import ollama_base_url
 
 load_dotenv()
 
 QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", 6334))
 COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME", "trigonometry_chapter")
 EMBEDDING_MODEL = os.getenv("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text")
+VECTOR_SIZE = int(os.getenv("VECTOR_SIZE", 0))  # 0 = detect from the model (768 for nomic-embed-text)
+OLLAMA_URL = ollama_base_url()
+# comma separated list of ollama servers, embedding batches are spread over them round robin
+OLLAMA_HOSTS = [h.strip() for h in os.getenv("OLLAMA_HOSTS", OLLAMA_URL).split(",") if h.strip()]
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 32))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", 2))  # in-flight batches per ollama server
+EMBED_RETRIES = 3
+RETRY_BASE = 0.5  # seconds, doubled on every retry
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH", 256))
+RING_SIZE = int(os.getenv("EMBED_RING_SIZE", 8))  # embedding batches buffered between the chunker thread and the embedder
+UPLOAD_PARALLEL = int(os.getenv("UPLOAD_PARALLEL", max(1, (os.cpu_count() or 2) // 2)))  # processes used by upload_points
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 800))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 150))
 PDF_PATH = os.getenv("PDF_PATH", "jemh109.pdf")
+INDEXING_THRESHOLD = 20000  # qdrant's default, restored once the bulk upload is done
 
-# making text to embeds
-def generate_embeddings(text: str, model: str = EMBEDDING_MODEL) -> list:
-    try:
-        response = ollama.embeddings(model=model, prompt=text)
-        return response["embedding"]
-    except Exception as e:
-        print(f"Error generating embedding: {e}")
-        print(f"ollama pull {model}")
-        return None
+# embeddings are deterministic per (text, model) so they are kept without expiry, re-runs only embed new or edited chunks
+embedding_cache = PromptCache(cache_dir="./cache/embeddings")
+
+# keep-alive pool shared by every sync call to ollama
+http = requests.Session()
+http.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+http.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+
+# Connection errors, timeouts and 5xx are retried with exponential backoff, anything else (or the last failure) is raised
+def _post_json(url: str, payload: dict, retries: int = EMBED_RETRIES, base: float = RETRY_BASE) -> dict:
+    for attempt in range(retries):
+        try:
+            response = http.post(url, json=payload, timeout=300)
+            if response.status_code < 500:
+                response.raise_for_status()
+                return response.json()
+            error = requests.HTTPError(f"{response.status_code} from {url}", response=response)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        if attempt < retries - 1:
+            time.sleep(base * 2 ** attempt)
+    raise error
+
+# making text to embeds, raises instead of returning None so a failed chunk can't quietly go missing from the index
+def generate_embeddings(text: str, model: str = EMBEDDING_MODEL, base_url: str = OLLAMA_URL) -> list:
+    return _post_json(f"{base_url}/api/embeddings", {"model": model, "prompt": text})["embedding"]
+
+def get_embedding_cached(text: str, model: str = EMBEDDING_MODEL) -> list:
+    key = embedding_cache._generate_key(text, model)
+    embedding = embedding_cache.cache.get(key)
+    if embedding is None:
+        embedding = generate_embeddings(text, model)
+        embedding_cache.cache.set(key, embedding, expire=None, tag=model)
+    return embedding
+
+# VECTOR_SIZE overrides, otherwise the size found by the first probe is remembered so later runs don't wake the model for it
+def embedding_dimension(model: str = EMBEDDING_MODEL) -> Optional[int]:
+    if VECTOR_SIZE:
+        return VECTOR_SIZE
+    key = f"dim:{model}"
+    size = embedding_cache.cache.get(key)
+    if size is None:
+        print(f"Testing embedding model: {model}")
+        try:
+            test_embedding = get_embedding_cached("test", model)
+        except Exception as e:
+            print(f"Error generating embedding: {e}")
+            print(f"ollama pull {model}")
+            return None
+        size = len(test_embedding)
+        embedding_cache.cache.set(key, size, expire=None, tag=model)
+    return size
+
+# One /api/embed request for a whole batch, older ollama servers without it (404) fall back to one call per text.
+# Same retry policy as _post_json
+async def generate_embeddings_batch(session: aiohttp.ClientSession, texts: List[str], base_url: str = OLLAMA_URL,
+                                    model: str = EMBEDDING_MODEL, retries: int = EMBED_RETRIES) -> List[list]:
+    for attempt in range(retries):
+        try:
+            async with session.post(f"{base_url}/api/embed", json={"model": model, "input": texts}) as response:
+                if response.status == 404:
+                    return await asyncio.to_thread(lambda: [generate_embeddings(text, model, base_url) for text in texts])
+                if response.status < 500:
+                    response.raise_for_status()
+                    return (await response.json())["embeddings"]
+                error = aiohttp.ClientResponseError(response.request_info, response.history, status=response.status)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            error = e
+        if attempt < retries - 1:
+            await asyncio.sleep(RETRY_BASE * 2 ** attempt)
+    raise error
 
 # Making of new db table with cosine similarity
 def setup_qdrant_collection(client: QdrantClient, collection_name: str, vector_size: int):
@@ -38,63 +128,145 @@ def setup_qdrant_collection(client: QdrantClient, collection_name: str, vector_s
         print(f"Collection '{collection_name}' already exists. Deleting ")
         client.delete_collection(collection_name)
 
+    # int8 copies stay in RAM for the HNSW search, the float32 originals go to disk and are only read for rescoring.
+    # indexing_threshold=0 keeps qdrant from rebuilding HNSW while points stream in, see build_collection_index
     client.create_collection(
         collection_name=collection_name,
-        vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE),
+        vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE, on_disk=True),
+        quantization_config=ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+        ),
+        optimizers_config=OptimizersConfigDiff(indexing_threshold=0),
     )
     print(f"✓ Created collection '{collection_name}' with vector size {vector_size}")
 
-# Indexing of the chunks
-def index_documents(chunks: list, client: QdrantClient, collection_name: str):
-    points = []
-    batch_size = 10  # 10 at a time
+# Turns HNSW indexing back on after the upload so the graph is built once over all points
+def build_collection_index(client: QdrantClient, collection_name: str):
+    client.update_collection(
+        collection_name=collection_name,
+        optimizers_config=OptimizersConfigDiff(indexing_threshold=INDEXING_THRESHOLD),
+    )
+    print(f"✓ Enabled HNSW indexing on '{collection_name}'")
+
+# metadata goes first so the explicit fields (and their defaults) can't be overwritten by it, only plain types end up in here
+def _payload(idx: int, chunk: dict) -> dict:
+    metadata = chunk["metadata"]
+    return {
+        **metadata,
+        "text": chunk["text"],
+        "page": metadata.get("page", -1),
+        "source": metadata.get("source", "unknown"),
+        "chunk_index": metadata.get("chunk_index", idx),
+    }
+
+# Cached embeddings are filled in first, only the misses are batched to ollama (a few batches at a time per server).
+# Returns one embedding per chunk in chunk order, a batch that still fails after retries aborts the run
+async def _embed_chunks(chunks: list, keys: List[str], progress: tqdm) -> List[list]:
+    results: List[Optional[list]] = [embedding_cache.cache.get(key) for key in keys]
+    misses = [i for i, embedding in enumerate(results) if embedding is None]
+    progress.update(len(chunks) - len(misses))
     
-    print(f"\nGenerating embeddings for {len(chunks)} chunks...")
-    for idx, chunk in enumerate(tqdm(chunks, desc="Processing")):
-        text = chunk["text"]
-        metadata = chunk["metadata"]
-        # Generate part fo the embedding
-        embedding = generate_embeddings(text)
-        
-        if embedding:
-            point = PointStruct(
-                id=idx,
-                vector=embedding,
-                payload={
-                    "text": text,
-                    "page": metadata.get("page", -1),
-                    "source": metadata.get("source", "unknown"),
-                    "chunk_index": metadata.get("chunk_index", idx),
-                    **metadata
-                }
-            )
-            points.append(point)
-        
-        # Uploading in batches of 10
-        if len(points) >= batch_size:
-            client.upsert(collection_name=collection_name, points=points)
-            points = []
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY * len(OLLAMA_HOSTS))
+    hosts = itertools.cycle(OLLAMA_HOSTS)
     
-    # Uploading leftover points
-    if points:
-        client.upsert(collection_name=collection_name, points=points)
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=300)) as session:
+        async def embed_batch(batch: List[int]):
+            async with semaphore:
+                embeddings = await generate_embeddings_batch(session, [chunks[i]["text"] for i in batch], next(hosts))
+            progress.update(len(batch))
+            with embedding_cache.cache.transact():
+                for i, embedding in zip(batch, embeddings):
+                    results[i] = embedding
+                    embedding_cache.cache.set(keys[i], embedding, expire=None, tag=EMBEDDING_MODEL)
+        
+        await asyncio.gather(*[
+            embed_batch(misses[start:start + EMBED_BATCH_SIZE]) for start in range(0, len(misses), EMBED_BATCH_SIZE)
+        ])
     
-    print(f"\n Successfully indexed {len(chunks)} chunks")
+    return results
+
+# Producer side of the pipeline, runs parse+chunk in its own thread. None marks the end, an exception is handed over to be re-raised
+def _produce(chunks: Iterable[dict], ring: queue.Queue):
+    try:
+        for chunk in chunks:
+            ring.put(chunk)
+        ring.put(None)
+    except BaseException as e:
+        ring.put(e)
 
+def _windows(ring: queue.Queue, size: int) -> Iterator[List[dict]]:
+    window = []
+    while True:
+        item = ring.get()
+        if item is None:
+            break
+        if isinstance(item, BaseException):
+            raise item
+        window.append(item)
+        if len(window) == size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+# Consumer side: chunks are embedded a window (RING_SIZE batches) at a time while the producer keeps parsing,
+# so memory stays O(window) instead of O(pages)
+def _points(chunks: Iterable[dict], progress: tqdm, counts: Counter) -> Iterator[PointStruct]:
+    ring = queue.Queue(maxsize=RING_SIZE * EMBED_BATCH_SIZE)
+    threading.Thread(target=_produce, args=(chunks, ring), daemon=True).start()
+    
+    # identical texts (the cache key is a content hash) are embedded once, the copies reuse that vector
+    # and keep their own page metadata with duplicate_of pointing at the first occurrence.
+    # Copies in a later window find the vector in the embedding cache
+    first: Dict[str, int] = {}
+    idx = 0
+    for window in _windows(ring, RING_SIZE * EMBED_BATCH_SIZE):
+        keys = [embedding_cache._generate_key(chunk["text"], EMBEDDING_MODEL) for chunk in window]
+        window_first: Dict[str, int] = {}
+        for pos, key in enumerate(keys):
+            window_first.setdefault(key, pos)
+        # batching similar lengths together keeps the server from padding short texts up to the longest one in the batch,
+        # points still get their original chunk index as id
+        unique = sorted(window_first.values(), key=lambda pos: len(window[pos]["text"]))
+        
+        progress.total = (progress.total or 0) + len(unique)
+        embeddings = asyncio.run(_embed_chunks([window[pos] for pos in unique], [keys[pos] for pos in unique], progress))
+        by_key = {keys[pos]: embedding for pos, embedding in zip(unique, embeddings)}
         
-        # Batch uploads every 50 points for efficiency
-    if len(points) >= 50:
-            client.upsert(collection_name=collection_name, points=points)
-            points = []
+        for chunk, key in zip(window, keys):
+            first.setdefault(key, idx)
+            counts[chunk["metadata"]["source"]] += 1
+            payload = _payload(idx, chunk)
+            if first[key] != idx:
+                payload["duplicate_of"] = first[key]
+                counts["duplicate"] += 1
+            counts["indexed"] += 1
+            yield PointStruct(id=idx, vector=by_key[key], payload=payload)
+            idx += 1
+
+# Indexing of the chunks, takes a list or a generator (streamed straight from the parser) and returns counts per source
+def index_documents(chunks: Iterable[dict], client: QdrantClient, collection_name: str) -> Counter:
+    print(f"\nGenerating embeddings...")
+    progress = tqdm(desc="Processing", unit="chunk")
+    counts = Counter()
     
-    # Uploading remaining points
-    if points:
-        client.upsert(collection_name=collection_name, points=points)
+    # qdrant's own uploader batches the points and spreads serialization over worker processes
+    client.upload_points(
+        collection_name=collection_name,
+        points=_points(chunks, progress, counts),
+        batch_size=UPSERT_BATCH_SIZE,
+        parallel=UPLOAD_PARALLEL,
+        max_retries=3,
+    )
+    progress.close()
     
-    print(f"\n Successfully indexed {len(chunks)} chunks")
+    print(f"\n Successfully indexed {counts['indexed']} chunks ({counts['duplicate']} duplicates reused)")
+    return counts
 
 
 def main():
+    # the parser reports progress through logging, shown as plain lines like the rest of the output
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     print("=" * 70)
     print("RAG SYSTEM SETUP PIPELINE")
     print("Chapter 9: Some Applications of Trigonometry (jemh109.pdf)")
@@ -106,58 +278,49 @@ def main():
         return
     print(f" PDF file found: {PDF_PATH}")
 
-    print(f"\n[2/5] Parsing PDF (extracting text, images, and formulas).")
-    parser = MultimodalPDFParser(PDF_PATH)
-    parser.open()
-    pages = parser.parse_full_document()
-    parser.close()
-    
-    total_images = sum(len(page["images"]) for page in pages)
-    total_math_blocks = sum(page.get("math_block_count", 0) for page in pages)
-    
-    print(f"\nExtracted content from {len(pages)} pages")
-    print(f"Found {total_images} images/diagrams (trigonometry figures)")
-    print(f"Detected {total_math_blocks} blocks with mathematical formulas")
-    
-    print(f"\n[3/5] Chunking documents with context preservation.")
-    print(f"  - Chunk size: {CHUNK_SIZE}")
-    print(f"  - Chunk overlap: {CHUNK_OVERLAP}")
-    chunker = AcademicChunker(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-    chunks = chunker.chunk_document(pages)
-    
-    text_chunks = [c for c in chunks if c["metadata"]["source"] == "text"]
-    image_chunks = [c for c in chunks if c["metadata"]["source"] == "image"]
-    
-    print(f"✓ Created {len(chunks)} chunks total")
-    print(f"  - Text chunks: {len(text_chunks)}")
-    print(f"  - Diagram/image chunks: {len(image_chunks)}")
-    
-    print(f"\n[4/5] Setting up Qdrant vector database")
+    # the collection has to exist first, pages are embedded and uploaded while the PDF is still being parsed
+    print(f"\n[2/5] Setting up Qdrant vector database")
     try:
-        client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
-        print(f" Connected to Qdrant at {QDRANT_HOST}:{QDRANT_PORT}")
+        # gRPC sends the points as protobuf, no json encoding of every payload on the client side
+        client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT, grpc_port=QDRANT_GRPC_PORT, prefer_grpc=True, timeout=60)
+        print(f" Connected to Qdrant at {QDRANT_HOST}:{QDRANT_GRPC_PORT} (gRPC)")
     except Exception as e:
         print(f"Error connecting to Qdrant: {e}")
         return
     
-    print(f"Testing embedding model: {EMBEDDING_MODEL}")
-    test_embedding = generate_embeddings("test")
-    if not test_embedding:
+    vector_size = embedding_dimension()
+    if not vector_size:
         return
-    
-    vector_size = len(test_embedding)
     print(f"Embedding dimension: {vector_size}")
     
     setup_qdrant_collection(client, COLLECTION_NAME, vector_size)
     
-    print(f"\n[5/5] Indexing documents in Qdrant...")
-    index_documents(chunks, client, COLLECTION_NAME)
+    print(f"\n[3/5] Parsing PDF (extracting text, images, and formulas) and chunking with context preservation.")
+    print(f"  - Chunk size: {CHUNK_SIZE}")
+    print(f"  - Chunk overlap: {CHUNK_OVERLAP}")
+    parser = MultimodalPDFParser(PDF_PATH)
+    parser.open()
+    chunker = AcademicChunker(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    chunks = chunker.iter_chunks(parser.iter_document())
+    
+    print(f"\n[4/5] Indexing documents in Qdrant...")
+    try:
+        counts = index_documents(chunks, client, COLLECTION_NAME)
+    finally:
+        parser.close()
+    
+    print(f"✓ Created {counts['text'] + counts['image']} chunks total")
+    print(f"  - Text chunks: {counts['text']}")
+    print(f"  - Diagram/image chunks: {counts['image']}")
+    
+    print(f"\n[5/5] Building the HNSW index")
+    build_collection_index(client, COLLECTION_NAME)
     
     print("\n" + "=" * 70)
     print(" SETUP COMPLETE!")
     print("=" * 70)
     print(f"\nQdrant collection '{COLLECTION_NAME}' created.")
-    print(f"Total documents indexed: {len(chunks)}")
+    print(f"Total documents indexed: {counts['indexed']}")
     print(f"\nYou can now run queries using:")
     print("  python rag_query.py --question \"Explain angle of elevation\"")
     print("  python rag_query.py --question \"What does Figure 9.4 show?\"")
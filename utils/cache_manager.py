@@ -1,22 +1,61 @@
 import hashlib
 import json
-from typing import Optional, Dict, Any, List
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Optional, Dict, Any, List, Callable
 import diskcache as dc
 from datetime import datetime
 
+# blake3 (SIMD) or xxh3 when installed, both are much cheaper than sha256 for cache keys. Not for anything adversarial
+try:
+    from blake3 import blake3 as _blake3
+
+    def content_hash(data: bytes) -> str:
+        return _blake3(data).hexdigest()
+except ImportError:
+    try:
+        import xxhash
+
+        def content_hash(data: bytes) -> str:
+            return xxhash.xxh3_128_hexdigest(data)
+    except ImportError:
+        def content_hash(data: bytes) -> str:
+            return hashlib.sha256(data).hexdigest()
+
+
 class PromptCache:   
-    def __init__(self, cache_dir: str = "./cache"):
-        self.cache = dc.Cache(cache_dir)
+    # diskcache keeps answers across runs, the OrderedDict in front is an in-process LRU so repeat hits skip sqlite
+    def __init__(self, cache_dir: str = "./cache", max_entries: int = 1024, ttl: int = 3600):
+        self.cache = dc.Cache(cache_dir, tag_index=True)
+        self._hot: OrderedDict = OrderedDict()   # key -> (expiry timestamp, cached data)
+        self._max = max_entries
+        self._ttl = ttl
+        self._semantic: Dict[str, tuple] = {}   # index key -> (cache keys, unit-norm embedding matrix)
     
     def _generate_key(self, prompt: str, model: str) -> str:
         content = f"{prompt}_{model}"
-        return hashlib.sha256(content.encode()).hexdigest()     # 64 digits unicode for labelling the question , same questions have same code
+        return content_hash(content.encode())     # hex digest for labelling the question , same questions have same code
+    
+    def _remember(self, key: str, cached_data: Dict[str, Any], expires_at: float):
+        self._hot[key] = (expires_at, cached_data)
+        self._hot.move_to_end(key)
+        if len(self._hot) > self._max:
+            self._hot.popitem(last=False)
     
     def get(self, prompt: str, model: str) -> Optional[Dict[str, Any]]:
         key = self._generate_key(prompt, model)
-        cached = self.cache.get(key)
         
+        entry = self._hot.get(key)
+        if entry and entry[0] > time.time():
+            self._hot.move_to_end(key)
+            print("Cache hit! Retrieving from cache")
+            return entry[1]
+        self._hot.pop(key, None)
+        
+        cached, expires_at = self.cache.get(key, expire_time=True)
         if cached:
+            self._remember(key, cached, expires_at or time.time() + self._ttl)
             print("Cache hit! Retrieving from cache")
             return cached
         
@@ -30,37 +69,109 @@ class PromptCache:
             "prompt": prompt,
             "model": model
         }
-        self.cache.set(key, cached_data, expire=3600)  # 1 hour expiry
+        self.cache.set(key, cached_data, expire=self._ttl, tag=model)  # 1 hour expiry by default
+        self._remember(key, cached_data, time.time() + self._ttl)
         print("Response cached")
     
+    def _semantic_index_key(self, model: str, namespace: str) -> str:
+        return f"__semantic__:{model}:{namespace}"
+
+    # numpy is imported only by the semantic layer, so --clear-cache/--clear-memory never load it
+    def _load_semantic(self, index_key: str) -> tuple:
+        import numpy as np
+        if index_key not in self._semantic:
+            keys, matrix = self.cache.get(index_key, ([], None))
+            if matrix is None:
+                matrix = np.empty((0, 0), dtype=np.float32)
+            self._semantic[index_key] = (list(keys), matrix)
+        return self._semantic[index_key]
+
+    # Embedding lookup for paraphrased prompts, rows are stored normalized so one matrix-vector product gives all cosine sims
+    def semantic_get(self, embedding: List[float], model: str, threshold: float = 0.92,
+                     namespace: str = "") -> Optional[Dict[str, Any]]:
+        import numpy as np
+        keys, matrix = self._load_semantic(self._semantic_index_key(model, namespace))
+        if not keys or matrix.shape[1] != len(embedding):
+            return None
+
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query)
+        sims = matrix @ query
+        best = int(np.argmax(sims))
+        if sims[best] < threshold:
+            return None
+
+        cached = self.cache.get(keys[best])
+        if cached:
+            print(f"Semantic cache hit! (similarity {sims[best]:.3f})")
+            return cached
+        return None
+
+    def semantic_set(self, embedding: List[float], prompt: str, model: str, namespace: str = ""):
+        import numpy as np
+        index_key = self._semantic_index_key(model, namespace)
+        keys, matrix = self._load_semantic(index_key)
+        key = self._generate_key(prompt, model)
+
+        # rows of another embedding size can't be compared with this one, so that index is started over
+        if matrix.shape[1:] != (len(embedding),):
+            keys, matrix = [], np.empty((0, len(embedding)), dtype=np.float32)
+
+        # dropping rows whose answers already expired so the index doesnt outgrow the cache
+        alive = [i for i, k in enumerate(keys) if k != key and k in self.cache]
+        keys = [keys[i] for i in alive]
+        matrix = matrix[alive] if alive else np.empty((0, len(embedding)), dtype=np.float32)
+
+        row = np.asarray(embedding, dtype=np.float32)
+        row /= np.linalg.norm(row)
+        keys.append(key)
+        matrix = np.vstack([matrix, row[None, :]])
+
+        self._semantic[index_key] = (keys, matrix)
+        self.cache.set(index_key, (keys, matrix), tag=model)
+
+    # Drops every answer (and semantic index) cached for one model, other models keep their entries
+    def invalidate_by_model(self, model: str) -> int:
+        removed = self.cache.evict(model)
+        for key in [k for k, (_, data) in self._hot.items() if data.get("model") == model]:
+            del self._hot[key]
+        prefix = self._semantic_index_key(model, "")
+        for index_key in [k for k in self._semantic if k.startswith(prefix)]:
+            del self._semantic[index_key]
+        print(f"Invalidated {removed} cache entries for model '{model}'")
+        return removed
+    
     def clear(self):
         self.cache.clear()
+        self._hot.clear()
+        self._semantic = {}
         print("Cache cleared")
 
 
 class ConversationalMemory:  
-    def __init__(self, memory_key: str = "chat_history"):
+    # bounded deque so a long session can't grow without limit, timestamps are plain time.time() floats
+    def __init__(self, memory_key: str = "chat_history", max_messages: int = 1024):
         self.memory_key = memory_key
-        self.messages: List[Dict[str, str]] = []
+        self.messages: deque = deque(maxlen=max_messages)
     
     def add_user_message(self, message: str):
         self.messages.append({
             "role": "user",
             "content": message,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": time.time()
         })
     
     def add_ai_message(self, message: str):
         self.messages.append({
             "role": "assistant",
             "content": message,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": time.time()
         })
     
-    def get_history(self, last_k: int = None) -> List[Dict[str, str]]:
+    def get_history(self, last_k: int = None) -> List[Dict[str, Any]]:
         if last_k:
-            return self.messages[-last_k:]
-        return self.messages
+            return list(islice(self.messages, max(0, len(self.messages) - last_k), None))
+        return list(self.messages)
     
     def get_formatted_history(self) -> str:
         formatted = []
@@ -69,6 +180,29 @@ class ConversationalMemory:
             formatted.append(f"{role}: {msg['content']}")
         return "\n".join(formatted)
     
+    def estimate_tokens(self) -> int:
+        return sum(len(msg["content"]) // 4 for msg in self.messages)   # ~4 chars per token is close enough for budgeting
+    
+    # Once over budget the oldest half is folded into one summary message, or just dropped when no summarizer is given
+    def compact(self, max_tokens: int = 2000,
+                summarizer: Optional[Callable[[List[Dict[str, Any]]], str]] = None) -> bool:
+        if len(self.messages) < 2 or self.estimate_tokens() <= max_tokens:
+            return False
+        
+        half = len(self.messages) // 2
+        oldest = list(islice(self.messages, 0, half))
+        # summarize before dropping anything, if the summarizer raises the history is left untouched
+        summary = summarizer(oldest) if summarizer else None
+        for _ in range(half):
+            self.messages.popleft()
+        if summary is not None:
+            self.messages.appendleft({
+                "role": "assistant",
+                "content": f"[summary so far] {summary}",
+                "timestamp": time.time()
+            })
+        return True
+    
     def clear(self):
-        self.messages = []
+        self.messages.clear()
         print("Conversation memory cleared")
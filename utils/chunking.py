@@ -1,36 +1,48 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from utils.matcher import PatternSet
+from utils.parallel import POOL_CONTEXT, ordered_map
+
+# Compiled once at import, all header patterns are matched in a single pass (hyperscan when installed, fused regex otherwise)
+_HEADER_PATTERNS = PatternSet([
+    r'equation\s+\d+',
+    r'formula\s+\d+',
+    r'theorem\s+\d+',
+    r'example\s+\d+',
+    r'Fig\.\s*\d+\.\d+',
+    r'solution:',
+    r'^\s*\d+\.\d+',    # Section numbers
+    r'tan\s*\d+°',
+    r'sin\s*\d+°',
+    r'cos\s*\d+°',
+], ignore_case=True)
+_FIG_RE = re.compile(r'Fig\.\s*\d+\.\d+')
+_SENT_RE = re.compile(r'(?<=[.!?])\s+(?=[A-Z]|\n)')
+
+# Same for every diagram, only the page number and file name differ between image chunks
+_IMAGE_CONTEXT = (
+    "This page discusses trigonometry applications including heights, distances, angles of elevation and depression. "
+    "The diagram illustrates geometric relationships, triangles, angles, or worked examples related to the text on this page."
+)
+
 class AcademicChunker:
     def __init__(self, chunk_size: int = 800, chunk_overlap: int = 150):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
     
     def is_formula_header(self, text: str) -> bool:
-        formula_patterns = [
-            r'equation\s+\d+',
-            r'formula\s+\d+',
-            r'theorem\s+\d+',
-            r'example\s+\d+',
-            r'Fig\.\s*\d+\.\d+',
-            r'solution:',
-            r'^\s*\d+\.\d+',    # Section numbers
-            r'tan\s*\d+°',
-            r'sin\s*\d+°',
-            r'cos\s*\d+°',
-        ]
-        
-        for pattern in formula_patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                return True
-        return False
+        return _HEADER_PATTERNS.search(text)
     
     def extract_figure_references(self, text: str) -> List[str]:
-        pattern = r'Fig\.\s*\d+\.\d+'
-        return re.findall(pattern, text)
+        return _FIG_RE.findall(text)
     
     def split_into_sentences(self, text: str) -> List[str]:
 
-        sentences = re.split(r'(?<=[.!?])\s+(?=[A-Z]|\n)', text)
+        sentences = _SENT_RE.split(text)
         return [s.strip() for s in sentences if s.strip()]
     
     def chunk_text(self, text: str, metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -47,85 +59,102 @@ class AcademicChunker:
         
         sentences = self.split_into_sentences(text)
         chunks = []
-        current_chunk = ""
-        current_sentences = []
+        # the chunk is only joined when it is emitted, buf_len tracks what len(" ".join(buf)) would be
+        buf: List[str] = []
+        buf_len = 0
+        buf_headers: List[bool] = []   # is_formula_header per buffered sentence, so has_formulas needs no rescan
         
         for sentence in sentences:
             # Check if this is a formula header - keep with next sentence
             is_header = self.is_formula_header(sentence)
             
             # Check if adding this sentence would exceed chunk size
-            test_length = len(current_chunk) + len(sentence) + 1
+            test_length = buf_len + len(sentence) + 1
             
-            if test_length > self.chunk_size and current_chunk and not is_header:
+            if test_length > self.chunk_size and buf and not is_header:
                 # Saving current chunk
                 chunks.append({
-                    "text": current_chunk.strip(),
+                    "text": " ".join(buf).strip(),
                     "metadata": {
                         **metadata,
                         "chunk_index": len(chunks),
-                        "sentence_count": len(current_sentences),
-                        "has_formulas": self.is_formula_header(current_chunk)
+                        "sentence_count": len(buf),
+                        "has_formulas": any(buf_headers)
                     }
                 })
                 
                 # Starting new chunk with overlap
-                overlap_size = min(2, len(current_sentences))
-                overlap_text = " ".join(current_sentences[-overlap_size:]) if overlap_size > 0 else ""
-                current_chunk = overlap_text + " " + sentence if overlap_text else sentence
-                current_sentences = current_sentences[-overlap_size:] + [sentence] if overlap_size > 0 else [sentence]
+                overlap_size = min(2, len(buf))
+                buf = buf[-overlap_size:] + [sentence]
+                buf_headers = buf_headers[-overlap_size:] + [is_header]
+                buf_len = sum(len(s) for s in buf) + len(buf) - 1
             else:
-                current_chunk += " " + sentence if current_chunk else sentence
-                current_sentences.append(sentence)
+                buf_len += len(sentence) + 1 if buf else len(sentence)
+                buf.append(sentence)
+                buf_headers.append(is_header)
         
         # Adding final chunk
-        if current_chunk:
+        if buf:
             chunks.append({
-                "text": current_chunk.strip(),
+                "text": " ".join(buf).strip(),
                 "metadata": {
                     **metadata,
                     "chunk_index": len(chunks),
-                    "sentence_count": len(current_sentences),
-                    "has_formulas": self.is_formula_header(current_chunk)
+                    "sentence_count": len(buf),
+                    "has_formulas": any(buf_headers)
                 }
             })
         return chunks
     
-    def chunk_document(self, pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        all_chunks = []
+    def chunk_page(self, page_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        page_num = page_data["page"]
+        text = page_data["text"]
+        images = page_data["images"]
+        has_math = page_data.get("has_math", False)
         
-        for page_data in pages:
-            page_num = page_data["page"]
-            text = page_data["text"]
-            images = page_data["images"]
-            has_math = page_data.get("has_math", False)
-            
-            text_chunks = self.chunk_text(
-                text,
-                {
+        page_chunks = self.chunk_text(
+            text,
+            {
+                "page": page_num,
+                "source": "text",
+                "has_images": page_data["has_images"],
+                "has_math": has_math
+            }
+        )
+        
+        for img in images:
+            img_chunk = {
+                "text": f"[DIAGRAM on Page {page_num + 1}] Figure/Diagram showing trigonometric concepts. Image file: {img['filename']}. {_IMAGE_CONTEXT}",
+                "metadata": {
                     "page": page_num,
-                    "source": "text",
-                    "has_images": page_data["has_images"],
-                    "has_math": has_math
-                }
-            )
-            all_chunks.extend(text_chunks)
-            
-            for img in images:
-                # Extracts surrounding text context aswell for image
-                context_text = f"This page discusses trigonometry applications including heights, distances, angles of elevation and depression."
-                
-                img_chunk = {
-                    "text": f"[DIAGRAM on Page {page_num + 1}] Figure/Diagram showing trigonometric concepts. Image file: {img['filename']}. {context_text} The diagram illustrates geometric relationships, triangles, angles, or worked examples related to the text on this page.",
-                    "metadata": {
-                        "page": page_num,
-                        "source": "image",
-                        "image_path": img["path"],
-                        "image_filename": img["filename"],
-                        "image_index": img["index"],
-                        "chunk_type": "diagram"
-                    }
+                    "source": "image",
+                    "image_path": img["path"],
+                    "image_filename": img["filename"],
+                    "image_index": img["index"],
+                    "chunk_type": "diagram"
                 }
-                all_chunks.append(img_chunk)
+            }
+            page_chunks.append(img_chunk)
         
-        return all_chunks
\ No newline at end of file
+        return page_chunks
+    
+    # Pages chunk independently so they are spread over worker processes, workers=1 stays in this process.
+    # Takes any iterable of pages (e.g. MultimodalPDFParser.iter_document) and yields chunks in page order
+    def iter_chunks(self, pages: Iterable[Dict[str, Any]], workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        workers = workers or os.cpu_count() or 1
+        if workers == 1:
+            for page_data in pages:
+                yield from self.chunk_page(page_data)
+            return
+        
+        with ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT) as executor:
+            for page_chunks in ordered_map(executor, _chunk_one_page, repeat((self.chunk_size, self.chunk_overlap)), pages,
+                                           window=2 * workers):
+                yield from page_chunks
+    
+    def chunk_document(self, pages: Iterable[Dict[str, Any]], workers: Optional[int] = None) -> List[Dict[str, Any]]:
+        return list(self.iter_chunks(pages, workers))
+
+
+def _chunk_one_page(params: tuple, page_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return AcademicChunker(*params).chunk_page(page_data)
@@ -0,0 +1,101 @@
+import re
+import threading
+from bisect import bisect_right
+from typing import List
+
+# hyperscan is optional, it matches every pattern in one compiled DFA pass (C code).
+# Without it the patterns run as one fused regex, on RE2 (linear time, no backtracking) when google-re2 is installed
+# and on python's re otherwise
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+
+def _compile(pattern: str):
+    if re2 is not None:
+        try:
+            return re2.compile(pattern)
+        except Exception:
+            pass   # outside RE2's syntax subset
+    return re.compile(pattern)
+
+
+class PatternSet:
+    # patterns must stay inside the syntax all three engines share (no lookarounds or backrefs)
+    def __init__(self, patterns: List[str], ignore_case: bool = False):
+        self.patterns = patterns
+        fused = ("(?i)" if ignore_case else "") + "|".join(f"(?:{p})" for p in patterns)
+        self._re = _compile(fused)
+        self._db = None
+        self._local = threading.local()
+
+        if hyperscan is not None:
+            flags = hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP | hyperscan.HS_FLAG_SINGLEMATCH
+            if ignore_case:
+                flags |= hyperscan.HS_FLAG_CASELESS
+            try:
+                db = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+                db.compile(
+                    expressions=[p.encode("utf-8") for p in patterns],
+                    ids=list(range(len(patterns))),
+                    elements=len(patterns),
+                    flags=[flags] * len(patterns),
+                )
+                self._db = db
+            except hyperscan.error:
+                self._db = None   # pattern hyperscan can't compile, regex fallback below still works
+
+    # hyperscan scratch space can't be shared by concurrent scans, each thread allocates its own once
+    def _scratch(self):
+        scratch = getattr(self._local, "scratch", None)
+        if scratch is None:
+            scratch = self._local.scratch = hyperscan.Scratch(self._db)
+        return scratch
+
+    def search(self, text: str) -> bool:
+        if self._db is None:
+            return self._re.search(text) is not None
+
+        found = False
+        def on_match(pattern_id, start, end, flags, context):
+            nonlocal found
+            found = True
+            return True   # stop at the first hit (HS_SCAN_TERMINATED)
+
+        try:
+            self._db.scan(text.encode("utf-8"), match_event_handler=on_match, scratch=self._scratch())
+        except getattr(hyperscan, "ScanTerminated", ()):
+            pass
+        return found
+
+    # One answer per text. The regex engines scan all texts joined by `sep` (which no pattern may match) and jump
+    # to the next text after each hit, hyperscan is already cheap per call so it just scans them one by one
+    def search_many(self, texts: List[str], sep: str = "\x00") -> List[bool]:
+        if self._db is not None:
+            return [self.search(text) for text in texts]
+
+        hits = [False] * len(texts)
+        starts = []
+        offset = 0
+        for text in texts:
+            starts.append(offset)
+            offset += len(text) + len(sep)
+        joined = sep.join(texts)
+
+        pos = 0
+        while True:
+            m = self._re.search(joined, pos)
+            if m is None:
+                break
+            i = bisect_right(starts, m.start()) - 1
+            hits[i] = True
+            if i + 1 == len(texts):
+                break
+            pos = starts[i + 1]
+        return hits
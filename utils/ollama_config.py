@@ -0,0 +1,27 @@
+import os
+from urllib.parse import urlsplit
+
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+
+
+# OLLAMA_BASE_URL (the README's .env setting) wins, then OLLAMA_HOST as the ollama client reads it, where a bare
+# "host" or "host:port" gets http:// and the default port. Same answer for every script that talks to ollama
+def ollama_base_url() -> str:
+    url = os.getenv("OLLAMA_BASE_URL")
+    if not url:
+        host = os.getenv("OLLAMA_HOST")
+        if not host:
+            return DEFAULT_OLLAMA_URL
+        url = host if "://" in host else f"http://{host}"
+        parts = urlsplit(url)
+        if parts.port is None and parts.scheme == "http":
+            url = f"{parts.scheme}://{parts.hostname}:11434{parts.path}"
+    return url.rstrip("/")
+
+
+# Local manifest check, an installed model is skipped without contacting the registry
+def has_model(name_tag: str) -> bool:
+    name, _, tag = name_tag.partition(':')
+    tag = tag or 'latest'
+    base = os.environ.get('OLLAMA_MODELS', os.path.expanduser('~/.ollama/models'))
+    return os.path.exists(os.path.join(base, 'manifests', 'registry.ollama.ai', 'library', name, tag))
@@ -0,0 +1,23 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, Callable, Iterable, Iterator
+
+# Start method for the process pools. setup_pipeline creates them from its producer thread, and forking a process that
+# already runs other threads (gRPC channel, tqdm monitor, the other pool's manager) can deadlock the child.
+# forkserver (or spawn where it doesn't exist) starts workers from a clean single-threaded process instead
+POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+# Like Executor.map but lazy on both ends: at most `window` calls are in flight, so a generator input is not
+# drained up front and finished results don't pile up in memory ahead of a slow consumer. Results keep input order
+def ordered_map(executor: Executor, fn: Callable, *iterables: Iterable, window: int = 8) -> Iterator[Any]:
+    pending = deque()
+    for args in zip(*iterables):
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -1,62 +1,107 @@
 import pymupdf
 import os
-from typing import List, Dict, Any
-import re
+import logging
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from itertools import repeat
+from typing import List, Dict, Any, ClassVar, Iterator, Optional, Set
+
+from utils.matcher import PatternSet
+from utils.parallel import POOL_CONTEXT, ordered_map
+
+# per-page and per-image progress goes through logging, formatting is skipped when the level filters it out
+log = logging.getLogger(__name__)
+
+_NON_DIGIT_BYTES = bytes(b for b in range(128) if not 48 <= b <= 57)
 
 class MultimodalPDFParser:
+    # All math markers compiled once into one matcher, one scan per block that stops at the first hit.
+    # The single symbols are one character class, and tan/sin/cos N° need no pattern of their own since ° alone matches
+    _MATH_PATTERNS = PatternSet([
+        r'[√∠°Δ]',
+        r'=\s*\d',
+        r'\d\s*m',
+        r'Fig\.\s*\d+\.\d+',
+    ])
+    _created_dirs: ClassVar[Set[str]] = set()
+    _content_cache: ClassVar[Dict[bytes, tuple]] = {}   # sha1 of image bytes -> (first file written with them, its write), per process
     
     #PDF Parser fn
-    def __init__(self, pdf_path: str):
+    # extract_blocks=False skips the per-block dict parse (bbox level blocks), pages then only carry text, images and has_math
+    def __init__(self, pdf_path: str, extract_blocks: bool = False):
         self.pdf_path = pdf_path
+        self.extract_blocks = extract_blocks
         self.doc = None
         self.images_dir = "extracted_images"
-        os.makedirs(self.images_dir, exist_ok=True)
+        self._write_pool = ThreadPoolExecutor(max_workers=4)   # image file writes, threads only start once used
+        self._xref_cache: Dict[int, Optional[Dict[str, Any]]] = {}   # xref -> first extracted image, None if it was too small
+        # created once per process, worker parsers and repeat instances skip the syscall
+        if self.images_dir not in MultimodalPDFParser._created_dirs:
+            os.makedirs(self.images_dir, exist_ok=True)
+            MultimodalPDFParser._created_dirs.add(self.images_dir)
     
     def open(self):
         self.doc = pymupdf.open(self.pdf_path)
-        print(f"Opened PDF: {self.pdf_path}")
-        print(f"Total pages: {len(self.doc)}")
+        log.info("Opened PDF: %s", self.pdf_path)
+        log.info("Total pages: %d", len(self.doc))
     
     def close(self):
         if self.doc:
             self.doc.close()
+        self._write_pool.shutdown(wait=True)
+
+    # Every math pattern needs a digit or one of the non-ascii symbols, so plain ascii text without a digit is ruled out
+    # by one C-level translate (which deletes all but the digit bytes) before any regex runs
+    @staticmethod
+    def _may_have_math(text: str) -> bool:
+        return not text.isascii() or bool(text.encode("ascii").translate(None, _NON_DIGIT_BYTES))
 
     #Taken string text as input and returns a bool value depending whether maths formulas are found or not
     def detect_mathematical_content(self, text: str) -> bool:
-        math_patterns = [
-            r'√', 
-            r'∠',  
-            r'°', 
-            r'tan\s*\d+°',
-            r'sin\s*\d+°',
-            r'cos\s*\d+°',
-            r'Δ',  
-            r'=\s*\d+',
-            r'\d+\s*m', 
-            r'Fig\.\s*\d+\.\d+',  
-        ]
-        
-        for pattern in math_patterns:
-            if re.search(pattern, text):
-                return True
-        return False
+        return self._may_have_math(text) and self._MATH_PATTERNS.search(text)
     
     def extract_text_from_page(self, page_num: int) -> str:
         page = self.doc[page_num]
         text = page.get_text()
         return text
     
+    # Compressed size of an image stream, -1 when the length is indirect or missing so the image is still decoded and checked
+    def _raw_stream_length(self, xref: int) -> int:
+        kind, value = self.doc.xref_get_key(xref, "Length")
+        return int(value) if kind == "int" else -1
+    
     def extract_images_from_page(self, page_num: int) -> List[Dict[str, Any]]:
         page = self.doc[page_num]
         image_list = page.get_images(full=True)
         extracted_images = []
+        writes = []
 
         MIN_IMAGE_SIZE = 10000  # Skipping images smaller than 10KB
 
         for img_index, img in enumerate(image_list):
             xref = img[0]
             
+            # same image object reused on another page (or twice on this one), it is already on disk or already skipped
+            if xref in self._xref_cache:
+                cached = self._xref_cache[xref]
+                if cached is not None:
+                    writes.append((None, {**cached, "page": page_num, "index": img_index}))
+                continue
+            
+            # get_images already has width, height, bits per component and colorspace, so the decoded size is known before
+            # touching the stream at all. Bullets and icons fall far below half the threshold
+            if _predicted_image_bytes(img) < MIN_IMAGE_SIZE * 0.5:
+                self._xref_cache[xref] = None
+                continue
+            
             try:
+                # The stream /Length is in the xref dictionary, tiny icons and rules are dropped before anything is decoded.
+                # Compressed size can undershoot the extracted one so the cut is loose here, the exact check follows
+                raw_len = self._raw_stream_length(xref)
+                if 0 <= raw_len < MIN_IMAGE_SIZE // 4:
+                    self._xref_cache[xref] = None
+                    continue
+                
                 # Extract image
                 base_image = self.doc.extract_image(xref)
                 image_bytes = base_image["image"]
@@ -64,13 +109,21 @@ class MultimodalPDFParser:
                 
                 # Skip tiny images
                 if len(image_bytes) < MIN_IMAGE_SIZE:
+                    self._xref_cache[xref] = None
                     continue
                 
                 image_filename = f"page_{page_num + 1}_img_{img_index}.{image_ext}"
                 image_path = os.path.join(self.images_dir, image_filename)
                 
-                with open(image_path, "wb") as img_file:
-                    img_file.write(image_bytes)
+                # the write runs on the pool while the next image is being extracted. Bytes already written for another
+                # document (shared templates, logos) are hard linked instead of written again
+                digest = hashlib.sha1(image_bytes).digest()
+                existing = MultimodalPDFParser._content_cache.get(digest)
+                if existing:
+                    write = self._write_pool.submit(_link_or_write, *existing, image_path, image_bytes)
+                else:
+                    write = self._write_pool.submit(_write_file, image_path, image_bytes)
+                    MultimodalPDFParser._content_cache[digest] = (image_path, write)
                 
                 img_data = {
                     "page": page_num,
@@ -79,89 +132,227 @@ class MultimodalPDFParser:
                     "filename": image_filename,
                     "extension": image_ext,
                     "xref": xref,
-                    "size": len(image_bytes)
+                    "size": len(image_bytes),
+                    "sha1": digest.hex()
                 }
                 
-                extracted_images.append(img_data)
-                print(f" Extracted image: {image_filename}")
+                self._xref_cache[xref] = img_data
+                writes.append((write, img_data))
                 
             except Exception as e:
-                print(f" Error extracting image {img_index} from page {page_num + 1}: {e}")
+                log.warning(" Error extracting image %d from page %d: %s", img_index, page_num + 1, e)
+
+        # every file is on disk before the page is handed back, a failed write drops that image.
+        # A repeat always comes after the entry that writes its xref, so repeats of a failed write on this page are dropped too
+        failed = set()
+        for write, img_data in writes:
+            if write is None:
+                if img_data["xref"] not in failed:
+                    extracted_images.append(img_data)
+                continue
+            try:
+                write.result()
+            except Exception as e:
+                failed.add(img_data["xref"])
+                self._xref_cache.pop(img_data["xref"], None)
+                digest = bytes.fromhex(img_data["sha1"])
+                if MultimodalPDFParser._content_cache.get(digest, (None,))[0] == img_data["path"]:
+                    del MultimodalPDFParser._content_cache[digest]
+                log.warning(" Error extracting image %d from page %d: %s", img_data["index"], page_num + 1, e)
+                continue
+            extracted_images.append(img_data)
+            log.info(" Extracted image: %s", img_data["filename"])
 
         return extracted_images
     
     def extract_blocks_from_page(self, page_num: int) -> List[Dict[str, Any]]:
         page = self.doc[page_num]
-        blocks = page.get_text("dict")["blocks"]
+        # "blocks" mode gives one (x0, y0, x1, y1, text, block_no, block_type) tuple per block with the text already joined,
+        # instead of the nested lines/spans dicts. Image blocks only show up with TEXT_PRESERVE_IMAGES
+        blocks = page.get_text("blocks", flags=pymupdf.TEXTFLAGS_BLOCKS | pymupdf.TEXT_PRESERVE_IMAGES)
         
         extracted_blocks = []
-        for block in blocks:
-            if block["type"] == 0:    # type 0 means if it is a text there
-                block_text = ""
-                for line in block.get("lines", []):
-                    for span in line.get("spans", []):   # span means individual text chunks with same formatting
-                        block_text += span["text"] + " "
-                
-                has_math = self.detect_mathematical_content(block_text)
+        text_blocks = []
+        block_texts = []
+        for x0, y0, x1, y1, block_text, _, block_type in blocks:
+            if block_type == 0:    # type 0 means if it is a text there
+                block_texts.append(block_text)
                 
-                extracted_blocks.append({
+                text_blocks.append({
                     "type": "text",
                     "content": block_text.strip(),
-                    "bbox": block["bbox"],
+                    "bbox": (x0, y0, x1, y1),
                     "page": page_num,
-                    "has_math": has_math
+                    "has_math": False
                 })
-            elif block["type"] == 1:  # Image block
+                extracted_blocks.append(text_blocks[-1])
+            elif block_type == 1:  # Image block, the pixels themselves come from extract_images_from_page
                 extracted_blocks.append({
                     "type": "image",
-                    "bbox": block["bbox"],
+                    "bbox": (x0, y0, x1, y1),
                     "page": page_num,
-                    "image_ref": block.get("image", None)
+                    "image_ref": None
                 })
         
+        # math detection for the whole page in one scan instead of one call per block, blocks the byte check rules out are left out
+        candidates = [i for i, text in enumerate(block_texts) if self._may_have_math(text)]
+        for i, has_math in zip(candidates, self._MATH_PATTERNS.search_many([block_texts[i] for i in candidates])):
+            text_blocks[i]["has_math"] = has_math
+        
         return extracted_blocks
     
-    def parse_full_document(self) -> List[Dict[str, Any]]:
-        all_chunks = []
+    def parse_page(self, page_num: int) -> Dict[str, Any]:
+        log.info("[Page %d/%d]", page_num + 1, len(self.doc))
+
+        if self.extract_blocks:
+            # the block extraction is the expensive part of a page, the plain text is derived from it instead of a second get_text()
+            blocks = self.extract_blocks_from_page(page_num)
+            page_text = "\n".join(b["content"] for b in blocks if b["type"] == "text")
+            math_blocks = sum(1 for b in blocks if b.get("has_math", False))
+            has_math = math_blocks > 0
+        else:
+            # no block structure wanted, plain text mode is much cheaper and math is checked once on the whole page
+            blocks = []
+            page_text = self.extract_text_from_page(page_num)
+            math_blocks = 0
+            has_math = self.detect_mathematical_content(page_text)
+
+        images = self.extract_images_from_page(page_num)
+        
+        if math_blocks > 0:
+            log.info(" Found %d blocks with mathematical content", math_blocks)
+
+        return {
+            "page": page_num,
+            "text": page_text,
+            "images": images,
+            "blocks": blocks,
+            "has_images": len(images) > 0,
+            "image_count": len(images),
+            "has_math": has_math,
+            "math_block_count": math_blocks
+        }
+    
+    # Pages are independent so they are spread over worker processes, each worker opens its own copy of the PDF.
+    # Pages are yielded in order as they finish, only a few are held at a time
+    def iter_document(self, max_workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        n_pages = len(self.doc)
+        workers = max_workers or min(os.cpu_count() or 1, 4)   # measured gains flatten out past ~4 workers for pymupdf parsing
+        log.info("Processing %d pages...", n_pages)
+        
         total_images = 0
         total_math_blocks = 0
+        math_pages = 0
+        with ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT, initializer=_init_worker_logging,
+                                 initargs=(log.getEffectiveLevel(),)) as executor:
+            for page in ordered_map(executor, _parse_page, repeat(self.pdf_path), range(n_pages), repeat(self.images_dir),
+                                    repeat(self.extract_blocks), window=2 * workers):
+                total_images += page["image_count"]
+                total_math_blocks += page["math_block_count"]
+                math_pages += page["has_math"]
+                yield page
+        
+        self._log_summary(n_pages, total_images, math_pages, total_math_blocks)
+    
+    # Whole document at once, each page drops into its preallocated slot as soon as it finishes (no waiting on a slow
+    # earlier page the way the ordered generator has to)
+    def parse_full_document(self, max_workers: Optional[int] = None) -> List[Dict[str, Any]]:
+        n_pages = len(self.doc)
+        workers = max_workers or min(os.cpu_count() or 1, 4)
+        log.info("Processing %d pages...", n_pages)
         
-        print(f"\nProcessing {len(self.doc)} pages...")
+        all_chunks: List[Optional[Dict[str, Any]]] = [None] * n_pages
+        with ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT, initializer=_init_worker_logging,
+                                 initargs=(log.getEffectiveLevel(),)) as executor:
+            futures = {
+                executor.submit(_parse_page, self.pdf_path, page_num, self.images_dir, self.extract_blocks): page_num
+                for page_num in range(n_pages)
+            }
+            for future in as_completed(futures):
+                all_chunks[futures[future]] = future.result()
         
-        for page_num in range(len(self.doc)):
-            print(f"\n[Page {page_num + 1}/{len(self.doc)}]")
+        self._log_summary(
+            n_pages,
+            sum(chunk["image_count"] for chunk in all_chunks),
+            sum(chunk["has_math"] for chunk in all_chunks),
+            sum(chunk["math_block_count"] for chunk in all_chunks),
+        )
+        return all_chunks
+    
+    def _log_summary(self, n_pages: int, total_images: int, math_pages: int, total_math_blocks: int):
+        log.info("=" * 60)
+        log.info("✓ Extraction Summary:")
+        log.info("  - Total pages: %d", n_pages)
+        log.info("  - Total images/diagrams: %d", total_images)
+        log.info("  - Pages with mathematical content: %d", math_pages)
+        if self.extract_blocks:
+            log.info("  - Blocks with mathematical content: %d", total_math_blocks)
+        log.info("=" * 60)
 
-            page_text = self.extract_text_from_page(page_num)
 
-            images = self.extract_images_from_page(page_num)
-            total_images += len(images)
+_COLORSPACE_CHANNELS = {"DeviceGray": 1, "CalGray": 1, "DeviceRGB": 3, "CalRGB": 3, "Lab": 3, "DeviceCMYK": 4}
 
-            blocks = self.extract_blocks_from_page(page_num)
+# Uncompressed pixel bytes of a get_images(full=True) entry, (xref, smask, width, height, bpc, colorspace, ...).
+# Unknown colorspaces (ICCBased, Indexed, ...) count as 3 channels and a missing bpc as 8
+def _predicted_image_bytes(img: tuple) -> int:
+    channels = _COLORSPACE_CHANNELS.get(img[5], 3)
+    bpc = img[4] or 8
+    return img[2] * img[3] * channels * bpc // 8
 
-            math_blocks = sum(1 for b in blocks if b.get("has_math", False))
-            total_math_blocks += math_blocks
-            
-            if math_blocks > 0:
-                print(f" Found {math_blocks} blocks with mathematical content")
-
-            chunk = {
-                "page": page_num,
-                "text": page_text,
-                "images": images,
-                "blocks": blocks,
-                "has_images": len(images) > 0,
-                "image_count": len(images),
-                "has_math": math_blocks > 0,
-                "math_block_count": math_blocks
-            }
-            
-            all_chunks.append(chunk)
-        
-        print(f"\n{'='*60}")
-        print(f"✓ Extraction Summary:")
-        print(f"  - Total pages: {len(self.doc)}")
-        print(f"  - Total images/diagrams: {total_images}")
-        print(f"  - Blocks with mathematical content: {total_math_blocks}")
-        print(f"{'='*60}")
-        
-        return all_chunks
\ No newline at end of file
+
+# Raw fd write, the bytes are already in memory so python's buffered file layer would only copy them again
+# O_EXCL so an existing file is unlinked rather than truncated, it may be a hard link shared with another image.
+# That also means a written inode never changes afterwards, its (st_dev, st_ino) is returned to identify it
+def _write_file(path: str, data: bytes) -> tuple:
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL
+    try:
+        fd = os.open(path, flags, 0o644)
+    except FileExistsError:
+        os.unlink(path)
+        fd = os.open(path, flags, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        st = os.fstat(fd)
+        return st.st_dev, st.st_ino
+    finally:
+        os.close(fd)
+
+
+# Links only after src's own write has finished, and keeps the link only if it reaches the inode that write produced.
+# File names don't include the document, so another PDF may have rewritten src since then. Anything else writes the bytes.
+# src_write was submitted before this call, so waiting on it from a pool thread can't deadlock
+def _link_or_write(src: str, src_write, path: str, data: bytes) -> tuple:
+    try:
+        src_id = src_write.result()
+        if os.path.abspath(src) != os.path.abspath(path):
+            if os.path.lexists(path):
+                os.unlink(path)
+            os.link(src, path)
+        st = os.stat(path)
+        if (st.st_dev, st.st_ino) == src_id:
+            return src_id
+    except Exception:
+        pass   # src failed or is gone, or no hard links on this filesystem
+    return _write_file(path, data)
+
+
+# Workers don't inherit the parent's logging setup under forkserver/spawn, page progress is shown at the parent's level
+def _init_worker_logging(level: int):
+    logging.basicConfig(level=level, format="%(message)s")
+
+
+# One parser per worker process, reused for every page that worker gets (pymupdf documents can't be pickled)
+_worker_parser: Optional[MultimodalPDFParser] = None
+
+def _parse_page(pdf_path: str, page_num: int, images_dir: str, extract_blocks: bool = False) -> Dict[str, Any]:
+    global _worker_parser
+    if _worker_parser is None or _worker_parser.pdf_path != pdf_path:
+        if _worker_parser is not None:
+            _worker_parser.close()
+        _worker_parser = MultimodalPDFParser(pdf_path)
+        _worker_parser.doc = pymupdf.open(pdf_path)
+    _worker_parser.images_dir = images_dir
+    _worker_parser.extract_blocks = extract_blocks
+    return _worker_parser.parse_page(page_num)